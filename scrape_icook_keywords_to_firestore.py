@@ -3,20 +3,52 @@
 scrape_icook_keywords_to_firestore.py
 - 針對常見食材關鍵字，在 iCook 搜尋頁抓取前 N 筆食譜
 - 解析 JSON-LD 取得：標題、主圖、食材、步驟(純文字)、時間、幾人份、連結
-- 儲存本地 JSON、累積歷史、並嘗試寫入 Firestore（優先從 GitHub Secret 讀金鑰）
+- 食譜頁優先用 httpx 抓原始 HTML 解析 JSON-LD，缺資料時才改用 Playwright
+- 搜尋結果依 URL 快取在本地磁碟，新鮮期內不重抓（食譜頁靠連結去重，不另外快取）
+- 儲存本地 JSON、累積歷史(JSONL)、並嘗試寫入 Firestore（優先從 GitHub Secret 讀金鑰）
 """
 
-import os, re, json, time, random
+import os, sys, re, json, time, random, asyncio, logging
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Tuple, Optional, Any
-from urllib.parse import urljoin, quote
+from typing import List, Set, Tuple, Optional, Any
+from urllib.parse import urljoin, urlsplit, quote
+
+import orjson
 
 # ---------- 設定 ----------
 LOG_FILE = "crawler.log"
 SAMPLE_FILE = "icook_keywords_sample.json"
-HISTORY_FILE = "icook_keywords_history.json"
+HISTORY_FILE = "icook_keywords_history.jsonl"  # 一行一筆，只 append
+LEGACY_HISTORY_FILE = "icook_keywords_history.json"  # 舊版整包 JSON 陣列，啟動時一次性轉入 JSONL
 LIMIT_PER_ING = 20    # 每個關鍵字抓幾筆
-RATE_DELAY = 1.2      # 基本等待（秒）
+RATE_LIMIT = 3        # 全域 token bucket：每 RATE_PERIOD 秒最多發出幾個請求
+RATE_PERIOD = 1.0
+POOL_SIZE = 6         # 常駐頁面數（同時導頁上限）
+PAGE_MAX_CHECKOUTS = 50  # 單一頁面被取用幾次後回收重開（一次取用可能含重試的多次導頁）
+CACHE_DIR = ".icook_cache"
+CACHE_SIZE_LIMIT = 16 * 1024 * 1024  # 快取上限（bytes），超過依 LRU 淘汰
+SEARCH_CACHE_TTL = 6 * 3600   # 搜尋結果快取新鮮期（秒），短一點才看得到新食譜
+HOST_CONCURRENCY = 6  # 對 icook.tw 同時進行的請求上限（HTTP + 瀏覽器合計）
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 4       # 429/5xx 最多重試幾次
+TIMEOUT_RETRIES = 1   # 逾時最多重試幾次（逾時本身就很耗時，不比照 MAX_RETRIES）
+NAV_TIMEOUT = 20000   # 單次導頁逾時（毫秒）
+BACKOFF_BASE = 2.0    # 第一次重試前等待（秒），之後每次加倍
+BACKOFF_CAP = 60.0    # 單次等待上限（秒）
+FIRESTORE_BATCH_LIMIT = 500  # 單一 WriteBatch 上限
+SELECTOR_TIMEOUT = 5000  # DOM 解析完後再等搜尋結果補齊的上限（毫秒）
+HTTP_MAX_CONNECTIONS = 20  # httpx 連線池上限（keep-alive 重用）
+# 只需要 HTML + JSON-LD：圖片/字型/樣式與第三方追蹤一律不載
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+BLOCKED_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "googlesyndication.com",
+    "doubleclick.net", "facebook.net", "facebook.com", "scorecardresearch.com",
+    "hotjar.com", "clarity.ms",
+)
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+              "AppleWebKit/537.36 (KHTML, like Gecko) "
+              "Chrome/124.0.0.0 Safari/537.36")
 
 COMMON_INGREDIENTS = [
     "雞肉","豬肉","牛肉","羊肉",
@@ -27,16 +59,29 @@ COMMON_INGREDIENTS = [
     "雞蛋","豆腐","白飯","麵條"
 ]
 
+# (關鍵字, 搜尋頁 URL) 在載入時算好一次
+SEARCH_TARGETS: List[Tuple[str, str]] = [
+    (kw, f"https://icook.tw/recipes/search?q={quote(kw)}") for kw in COMMON_INGREDIENTS
+]
+
 # ---------- Log ----------
+# 專用 logger：log 檔整個執行期間只開一次；開檔失敗就只輸出到 stdout，不中斷。
+# 不往 root 傳遞，httpx / Google client 的 INFO 訊息不會混進來
+logger = logging.getLogger("icook")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_handlers: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+try:
+    _log_handlers.append(logging.FileHandler(LOG_FILE, encoding="utf-8"))
+except Exception:
+    pass
+_log_formatter = logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+for _h in _log_handlers:
+    _h.setFormatter(_log_formatter)
+    logger.addHandler(_h)
+
 def log(msg: str):
-    text = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}"
-    print(text)
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(text + "\n")
-    except Exception:
-        # 若寫 log 失敗也不要中斷
-        pass
+    logger.info(msg)
 
 # ---------- Firestore 初始化：先從環境變數 SERVICE_ACCOUNT_KEY（GitHub Secret）讀，再 fallback 本地檔 ----------
 db = None
@@ -70,21 +115,117 @@ else:
         log("ℹ️ 未找到 SERVICE_ACCOUNT_KEY 與本地金鑰，僅輸出到本地 JSON")
 
 # ---------- Playwright (會在 runtime import) ----------
-from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+
+# ---------- HTTP 輕量路徑（食譜頁 JSON-LD 直接在原始 HTML 中） ----------
+import httpx
+from aiolimiter import AsyncLimiter
+from selectolax.parser import HTMLParser
+
+# ---------- 本地快取：搜尋頁 URL -> 搜尋結果（磁碟上的 LRU，大小有上限） ----------
+# 食譜頁不快取：成功抓過的連結已由歷史 / Firestore 去重，之後不會再請求
+import diskcache
+cache = diskcache.Cache(CACHE_DIR, size_limit=CACHE_SIZE_LIMIT,
+                        eviction_policy="least-recently-used")
 
 # ---------- 工具函式 ----------
-def upsert_firestore(doc: dict):
-    assert "link" in doc
-    doc_id = doc["link"].replace("https://", "").replace("http://", "").replace("/", "_")
-    db.collection("recipes").document(doc_id).set(doc)
-    return doc_id
+_RE_RECIPE_PATH = re.compile(r"/recipes/\d+")
+_RE_PT_H = re.compile(r"PT(\d+)H")
+_RE_PT_M = re.compile(r"(\d+)M")
+_DOC_ID_TABLE = str.maketrans({"/": "_"})
+
+def recipe_doc_id(link: str) -> str:
+    return link.split("://", 1)[-1].translate(_DOC_ID_TABLE)
+
+def upsert_firestore(docs: List[dict]) -> int:
+    """以 WriteBatch 批次寫入，每批最多 FIRESTORE_BATCH_LIMIT 筆，回傳寫入筆數"""
+    col = db.collection("recipes")
+    for start in range(0, len(docs), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for doc in docs[start:start + FIRESTORE_BATCH_LIMIT]:
+            assert "link" in doc
+            batch.set(col.document(recipe_doc_id(doc["link"])), doc)
+        batch.commit()
+    return len(docs)
+
+def append_history(docs: List[dict]) -> bool:
+    """回傳是否全部寫入成功；失敗只記 log，不中斷"""
+    try:
+        with open(HISTORY_FILE, "ab") as f:
+            for doc in docs:
+                f.write(orjson.dumps(doc) + b"\n")
+        return True
+    except Exception as e:
+        log(f"⚠️ 寫入 {HISTORY_FILE} 失敗：{e}")
+        return False
+
+def migrate_legacy_history():
+    """舊版 JSON 陣列歷史轉寫成 JSONL，完成後改名保留，避免重複轉入"""
+    if not os.path.exists(LEGACY_HISTORY_FILE):
+        return
+    try:
+        with open(LEGACY_HISTORY_FILE, "rb") as f:
+            history = orjson.loads(f.read())
+        if not isinstance(history, list):
+            raise ValueError("內容不是 JSON 陣列")
+        docs = [d for d in history if isinstance(d, dict)]
+        if not append_history(docs):
+            # 保留舊檔，下次啟動再轉一次
+            log(f"⚠️ 舊版 {LEGACY_HISTORY_FILE} 轉入失敗，保留原檔待下次重試")
+            return
+        os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE + ".migrated")
+        log(f"📦 已將舊版 {LEGACY_HISTORY_FILE} 的 {len(docs)} 筆轉入 {HISTORY_FILE}")
+    except Exception as e:
+        log(f"⚠️ 舊版 {LEGACY_HISTORY_FILE} 轉入失敗，本次不會讀取它：{e}")
+
+def find_existing_in_firestore(links: List[str]) -> Set[str]:
+    """只查這幾筆候選連結對應的文件是否存在（doc id 由 link 推得），不掃整個 collection"""
+    col = db.collection("recipes")
+    ids = {recipe_doc_id(u): u for u in links}
+    snaps = db.get_all([col.document(i) for i in ids], field_paths=["link"])
+    return {ids[s.id] for s in snaps if s.exists and s.id in ids}
+
+def load_seen_links() -> Set[str]:
+    """已抓過的食譜連結（本地 JSONL 歷史）；Firestore 端改在排程前逐筆查候選連結"""
+    seen: Set[str] = set()
+    if os.path.exists(HISTORY_FILE):
+        try:
+            with open(HISTORY_FILE, "rb") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line: continue
+                    try:
+                        link = orjson.loads(line).get("link")
+                    except Exception:
+                        continue
+                    if link: seen.add(link)
+        except Exception as e:
+            log(f"⚠️ 讀取 {HISTORY_FILE} 失敗：{e}")
+    return seen
+
+def cache_get_fresh(key: str, ttl: float) -> Optional[dict]:
+    """取出 ttl 秒內寫入的快取項目，過期視同沒有；讀取失敗也當作沒有，不中斷"""
+    try:
+        entry = cache.get(key)
+    except Exception as e:
+        log(f"⚠️ 讀取快取失敗：{e}")
+        return None
+    if entry and time.time() - entry.get("fetched", 0) < ttl:
+        return entry
+    return None
+
+def cache_put(key: str, value: dict):
+    try:
+        cache.set(key, value)
+    except Exception as e:
+        log(f"⚠️ 寫入快取失敗：{e}")
 
 def iso8601_duration_to_text(s: str) -> Optional[str]:
     if not s: return None
     if not s.startswith("PT"): return s
     hours = minutes = 0
-    m_h = re.search(r"PT(\d+)H", s)
-    m_m = re.search(r"(\d+)M", s)
+    m_h = _RE_PT_H.search(s)
+    m_m = _RE_PT_M.search(s)
     if m_h: hours = int(m_h.group(1))
     if m_m: minutes = int(m_m.group(1))
     if hours == 0 and minutes == 0: return None
@@ -112,18 +253,17 @@ def extract_steps_from_ld(obj: Any) -> List[str]:
                 t = it.strip()
                 if t: steps.append(t)
             elif isinstance(it, dict):
-                t = it.get("text") or it.get("name")
-                if t and str(t).strip():
-                    steps.append(str(t).strip())
+                t = ensure_str(it.get("text") or it.get("name"))
+                if t: steps.append(t)
     if isinstance(obj, list): pick_from_list(obj)
     elif isinstance(obj, dict):
         if obj.get("@type") == "HowToSection" and isinstance(obj.get("itemListElement"), list):
             pick_from_list(obj["itemListElement"])
         else:
-            t = obj.get("text") or obj.get("name")
-            if t and str(t).strip():
-                steps.append(str(t).strip())
-    return [s for s in (s.strip() for s in steps) if s]
+            t = ensure_str(obj.get("text") or obj.get("name"))
+            if t: steps.append(t)
+    # 加入前皆已 strip 並濾掉空字串
+    return steps
 
 def parse_ld_json(ld_texts: List[str]) -> Tuple[Optional[str], List[str], Optional[str], Optional[str], List[str], Optional[str]]:
     title = None
@@ -134,8 +274,11 @@ def parse_ld_json(ld_texts: List[str]) -> Tuple[Optional[str], List[str], Option
     image_url = None
 
     for raw in ld_texts:
+        # 沒有 "@type"/"Recipe" 字樣的區塊（BreadcrumbList、Organization…）不必解析
+        if '"@type"' not in raw or '"Recipe"' not in raw:
+            continue
         try:
-            data = json.loads(raw)
+            data = orjson.loads(raw)
         except Exception:
             continue
 
@@ -164,7 +307,7 @@ def parse_ld_json(ld_texts: List[str]) -> Tuple[Optional[str], List[str], Option
                 if not ingredients:
                     ing = node.get("recipeIngredient")
                     if isinstance(ing, list):
-                        ingredients = [str(x).strip() for x in ing if str(x).strip()]
+                        ingredients = [t for t in (str(x).strip() for x in ing) if t]
 
                 if not time_text:
                     t = ensure_str(node.get("totalTime")) or ensure_str(node.get("cookTime"))
@@ -187,163 +330,372 @@ def parse_ld_json(ld_texts: List[str]) -> Tuple[Optional[str], List[str], Option
                 if not image_url:
                     image_url = extract_image_url_from_ld(node.get("image"))
 
+                # 六個欄位都齊了就不用再看其餘區塊 / @graph 節點
+                if title and ingredients and time_text and yield_info and steps and image_url:
+                    return title, ingredients, time_text, yield_info, steps, image_url
+
     return title, ingredients, time_text, yield_info, steps, image_url
 
-# ---------- 抓單一關鍵字的邏輯 ----------
-def scrape_keyword(keyword: str, page) -> List[dict]:
-    search_url = f"https://icook.tw/recipes/search?q={quote(keyword)}"
-    log(f"🔎 搜尋關鍵字：{keyword} -> {search_url}")
-    page.goto(search_url, wait_until="domcontentloaded", timeout=60000)
-    page.wait_for_timeout(1500)
-
-    anchors = page.locator("a[href^='/recipes/']").all()
-    links = []
-    for a in anchors:
-        href = a.get_attribute("href")
-        if href and re.fullmatch(r"/recipes/\d+", href):
-            links.append(urljoin("https://icook.tw", href))
-    links = list(dict.fromkeys(links))[:LIMIT_PER_ING]
-    log(f"👉 找到 {len(links)} 筆")
-
-    saved: List[dict] = []
-    for i, url in enumerate(links, 1):
-        log(f"  [{i}/{len(links)}] 抓取：{url}")
-        try:
-            page.goto(url, wait_until="domcontentloaded", timeout=60000)
-            page.wait_for_timeout(800)
-            scripts = page.locator("script[type='application/ld+json']").all()
-        except Exception as e:
-            log(f"  ⚠️ 開啟頁面失敗：{e}")
-            continue
+# ---------- 頁面端批次擷取（一次 page.evaluate 取代多次 locator 往返） ----------
+# 搜尋結果（不同的 /recipes/<id>）至少 n 筆才算載入完成；header / nav 連結不計
+_JS_SEARCH_READY = """
+n => new Set(Array.from(document.querySelectorAll("a[href^='/recipes/']"), a => a.getAttribute("href"))
+               .filter(h => /^\\/recipes\\/\\d+$/.test(h))).size >= n
+"""
 
-        ld_texts = []
-        for s in scripts:
-            try:
-                txt = s.inner_text()
-                if txt and "Recipe" in txt: ld_texts.append(txt)
-            except Exception:
-                pass
+_JS_RECIPE_HREFS = """
+() => Array.from(document.querySelectorAll("a[href^='/recipes/']"), a => a.getAttribute("href"))
+"""
 
-        title, ingredients, time_text, yield_info, steps, image_url = parse_ld_json(ld_texts)
+_JS_RECIPE_EXTRACT = """
+() => {
+  const texts = sel => Array.from(document.querySelectorAll(sel), e => (e.innerText || "").trim()).filter(Boolean);
+  const h1 = document.querySelector("h1");
+  const og = document.querySelector("meta[property='og:image']");
+  return {
+    ld: Array.from(document.querySelectorAll("script[type='application/ld+json']"), s => s.textContent || ""),
+    title: h1 ? (h1.innerText || "").trim() : null,
+    image: og ? og.getAttribute("content") : null,
+    steps: texts("li[class*=step], .step, [class*=instruction] li"),
+    ingredients: texts("li[class*='ingredient'], .ingredients li, [data-ingredient-name]"),
+  };
+}
+"""
 
-        # fallback: title / image / steps / ingredients
-        if not title:
-            try:
-                title = page.locator("h1").first.inner_text().strip()
-            except Exception:
-                title = "(未找到標題)"
-        if not image_url:
-            try:
-                og = page.locator("meta[property='og:image']").first.get_attribute("content")
-                if og and og.startswith("http"):
-                    image_url = og
-            except Exception:
-                pass
-        if not steps:
-            try:
-                candidates = page.locator("li[class*=step], .step, [class*=instruction] li").all()
-                tmp = [(c.inner_text() or "").strip() for c in candidates if (c.inner_text() or "").strip()]
-                if tmp:
-                    steps = tmp
-            except Exception:
-                pass
-        if not ingredients:
+async def wait_for_ready(page, predicate: str, arg: Any = None, timeout: int = SELECTOR_TIMEOUT):
+    """等到頁面上的資料齊了（predicate 為真）就返回；逾時不視為錯誤，交給後續 fallback 處理"""
+    try:
+        await page.wait_for_function(predicate, arg=arg, timeout=timeout)
+    except PlaywrightTimeoutError:
+        pass
+
+def is_blocked_host(host: str) -> bool:
+    # 完全相同或其子網域才算；避免 notfacebook.com 之類的誤判
+    return any(host == h or host.endswith("." + h) for h in BLOCKED_HOSTS)
+
+async def block_heavy_resources(route):
+    req = route.request
+    host = urlsplit(req.url).hostname or ""
+    if req.resource_type in BLOCKED_RESOURCE_TYPES or is_blocked_host(host):
+        await route.abort()
+    else:
+        await route.continue_()
+
+# ---------- 對 iCook 的請求：全域速率 + per-host 併發上限 + 429/5xx/逾時指數退避 ----------
+class RetryableError(Exception):
+    pass
+
+host_sem = asyncio.Semaphore(HOST_CONCURRENCY)
+limiter = AsyncLimiter(RATE_LIMIT, RATE_PERIOD)
+
+async def polite_fetch(fn, what: str):
+    """在 host_sem 名額內、取得 limiter token 後執行 fn()；遇到可重試錯誤時釋放名額、退避後再試"""
+    backoff = BACKOFF_BASE
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with host_sem:
+                # token bucket 控制整體平均頻率，不必在請求之間固定 sleep
+                async with limiter:
+                    return await fn()
+        except (RetryableError, PlaywrightTimeoutError, httpx.TimeoutException) as e:
+            is_timeout = not isinstance(e, RetryableError)
+            if attempt == MAX_RETRIES or (is_timeout and attempt >= TIMEOUT_RETRIES):
+                raise
+            log(f"  ⏳ {what} 暫時失敗（{e}），{backoff:.0f} 秒後重試")
+            await asyncio.sleep(backoff + random.uniform(0, 1))
+            backoff = min(backoff * 2, BACKOFF_CAP)
+
+async def goto_checked(page, url: str):
+    # 等到 HTML 完整解析（body 內的 h1 / 食材 / 步驟、搜尋結果才讀得到），不再額外固定 sleep
+    resp = await page.goto(url, wait_until="domcontentloaded", timeout=NAV_TIMEOUT)
+    if resp and resp.status in RETRY_STATUS:
+        raise RetryableError(f"HTTP {resp.status}")
+
+# ---------- Page pool ----------
+class PagePoolExhausted(RuntimeError):
+    pass
+
+class PagePool:
+    """同一個 context 內常駐 N 個頁面；worker 取用 -> 導頁 -> 歸還。
+    取用滿 max_checkouts 次、頁面崩潰或出現非逾時的 Playwright 錯誤時關掉重開"""
+
+    def __init__(self, ctx, size: int, max_checkouts: int):
+        self.ctx = ctx
+        self.size = size
+        self.max_checkouts = max_checkouts
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._crashed: set = set()
+
+    async def _new_page(self):
+        page = await self.ctx.new_page()
+        # renderer 崩潰（OOM、Target crashed）時頁面不會自己 close，需另外標記
+        page.on("crash", lambda p: self._crashed.add(p))
+        return page
+
+    async def start(self):
+        for _ in range(self.size):
+            self._queue.put_nowait((await self._new_page(), 0))
+
+    @asynccontextmanager
+    async def page(self):
+        item = await self._queue.get()
+        if item is None:
+            # 所有頁面都已失效：把哨兵放回去讓其他等待者也結束，而不是永遠卡在 get()
+            self._queue.put_nowait(None)
+            raise PagePoolExhausted("page pool 已無可用頁面")
+        page, checkouts = item
+        broken = False
+        try:
+            yield page
+        except PlaywrightError as e:
+            # 逾時不代表頁面壞掉；其他 Playwright 錯誤（如 Target crashed）就換一個頁面
+            broken = not isinstance(e, PlaywrightTimeoutError)
+            raise
+        finally:
+            checkouts += 1
+            if broken or page in self._crashed or checkouts >= self.max_checkouts or page.is_closed():
+                # 回收：壞掉的頁面，或避免單一頁面長時間累積記憶體
+                self._crashed.discard(page)
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+                try:
+                    page, checkouts = await self._new_page(), 0
+                except Exception as e:
+                    # 重開失敗（瀏覽器崩潰 / OOM）：不可蓋掉原本的例外，池子縮小一格
+                    page = None
+                    self.size -= 1
+                    log(f"⚠️ 重開頁面失敗，page pool 剩 {self.size} 個：{e}")
+            if page is not None:
+                self._queue.put_nowait((page, checkouts))
+            elif self.size <= 0:
+                self._queue.put_nowait(None)
+
+    async def close(self):
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None: continue
+            page, _ = item
             try:
-                items = page.locator("li[class*='ingredient'], .ingredients li, [data-ingredient-name]").all()
-                tmp = [(it.inner_text() or "").strip() for it in items if (it.inner_text() or "").strip()]
-                if tmp:
-                    ingredients = tmp
+                await page.close()
             except Exception:
                 pass
 
-        doc = {
-            "title": title or "",
-            "ingredients": ingredients,
-            "steps": steps,
-            "time": time_text,
-            "yield": yield_info,
-            "link": url,
-            "imageUrl": image_url,
-            "source": "icook"
-        }
-
-        if ingredients:
-            if db:
-                try:
-                    doc_id = upsert_firestore(doc)
-                    log(f"📝 已寫入 Firestore：recipes/{doc_id}")
-                except Exception as e:
-                    log(f"⚠️ 寫入 Firestore 失敗：{e}")
-            saved.append(doc)
-        else:
-            log("  ⚠️ 此頁未抓到食材，略過")
+# ---------- 抓單一食譜頁：先走 HTTP，JSON-LD 不足再開瀏覽器 ----------
+async def fetch_recipe_http(client: httpx.AsyncClient, url: str) -> List[str]:
+    """直接 GET 原始 HTML，取出含 Recipe 的 JSON-LD 區塊（不需 JS runtime）"""
+    r = await client.get(url)
+    if r.status_code in RETRY_STATUS:
+        raise RetryableError(f"HTTP {r.status_code}")
+    r.raise_for_status()
+    ld_texts = []
+    for node in HTMLParser(r.text).css("script[type='application/ld+json']"):
+        txt = node.text()
+        if txt and "Recipe" in txt: ld_texts.append(txt)
+    return ld_texts
+
+async def scrape_recipe_browser(url: str, pool: PagePool) -> Optional[tuple]:
+    try:
+        async with pool.page() as page:
+            async def load():
+                await goto_checked(page, url)
+                # JSON-LD 與 fallback 欄位一次 evaluate 取回
+                return await page.evaluate(_JS_RECIPE_EXTRACT)
+            data = await polite_fetch(load, url)
+    except Exception as e:
+        log(f"  ⚠️ 開啟頁面失敗：{e}")
+        return None
+
+    ld_texts = [t for t in data.get("ld") or [] if t and "Recipe" in t]
+    title, ingredients, time_text, yield_info, steps, image_url = parse_ld_json(ld_texts)
+
+    # fallback: title / image / steps / ingredients
+    if not title:
+        title = data.get("title") or "(未找到標題)"
+    if not image_url:
+        og = data.get("image")
+        if og and og.startswith("http"):
+            image_url = og
+    if not steps and data.get("steps"):
+        steps = data["steps"]
+    if not ingredients and data.get("ingredients"):
+        ingredients = data["ingredients"]
+
+    return title, ingredients, time_text, yield_info, steps, image_url
+
+async def scrape_recipe(url: str, client: httpx.AsyncClient, pool: PagePool, tag: str) -> Optional[dict]:
+    log(f"  {tag} 抓取：{url}")
+    parsed = None
+    try:
+        ld_texts = await polite_fetch(lambda: fetch_recipe_http(client, url), url)
+        parsed = parse_ld_json(ld_texts)
+    except (RetryableError, httpx.TimeoutException) as e:
+        # 已退避到上限仍被限流 / 逾時：不再改用瀏覽器打同一個 host
+        log(f"  ⚠️ 持續被限流或逾時，略過：{e!r}")
+        return None
+    except Exception as e:
+        log(f"  ⚠️ HTTP 抓取失敗，改用瀏覽器：{e}")
+
+    # JSON-LD 沒有食材（或非限流的 HTTP 失敗）才動用 Playwright
+    if not parsed or not parsed[1]:
+        parsed = await scrape_recipe_browser(url, pool)
+        if parsed is None:
+            return None
+    title, ingredients, time_text, yield_info, steps, image_url = parsed
+
+    doc = {
+        "title": title or "",
+        "ingredients": ingredients,
+        "steps": steps,
+        "time": time_text,
+        "yield": yield_info,
+        "link": url,
+        "imageUrl": image_url,
+        "source": "icook"
+    }
+
+    if not ingredients:
+        log("  ⚠️ 此頁未抓到食材，略過")
+        return None
+    return doc
 
-        # polite delay + small random jitter between requests
-        page.wait_for_timeout(int(RATE_DELAY * 1000 + random.uniform(200, 800)))
+# ---------- 抓單一關鍵字的邏輯 ----------
+async def scrape_keyword(keyword: str, search_url: str, client: httpx.AsyncClient, pool: PagePool,
+                         seen: Set[str]) -> List[dict]:
+    entry = cache_get_fresh(search_url, SEARCH_CACHE_TTL)
+    if entry:
+        log(f"🔎 搜尋關鍵字（快取）：{keyword} -> {search_url}")
+        hrefs = entry["hrefs"]
+    else:
+        log(f"🔎 搜尋關鍵字：{keyword} -> {search_url}")
+        try:
+            async with pool.page() as page:
+                async def load():
+                    await goto_checked(page, search_url)
+                    # 搜尋結果若由 JS 補上，等到湊滿 LIMIT_PER_ING 筆食譜連結
+                    await wait_for_ready(page, _JS_SEARCH_READY, LIMIT_PER_ING)
+                    return await page.evaluate(_JS_RECIPE_HREFS)
+                hrefs = await polite_fetch(load, search_url)
+        except Exception as e:
+            log(f"⚠️ 搜尋頁開啟失敗（{keyword}）：{e}")
+            return []
+        # 只快取完整的搜尋結果；不足 LIMIT_PER_ING 筆可能是頁面沒載完，下次重抓
+        n_recipes = len({h for h in hrefs if h and _RE_RECIPE_PATH.fullmatch(h)})
+        if n_recipes >= LIMIT_PER_ING:
+            cache_put(search_url, {"hrefs": hrefs, "fetched": time.time()})
+
+    async def drop_known(urls: List[str]) -> List[str]:
+        # Firestore 已有的連結跳過；查詢失敗就照抓（upsert 會覆蓋，不會重複）
+        existing: Set[str] = set()
+        if db:
+            try:
+                existing = await asyncio.to_thread(find_existing_in_firestore, urls)
+            except Exception as e:
+                log(f"⚠️ 查詢 Firestore 既有連結失敗（{keyword}）：{e}")
+        # await 期間其他 keyword 可能已排入同一筆，再濾一次後立即標記
+        new = [u for u in urls if u not in existing and u not in seen]
+        seen.update(urls)
+        return new
+
+    # 依序去重，每湊滿一批候選就查 Firestore，新食譜湊滿 LIMIT_PER_ING 筆就停；
+    # 跳過先前（或其他 keyword 本次）已抓過的連結
+    links: List[str] = []
+    pending: dict = {}
+    for href in hrefs:
+        if href and _RE_RECIPE_PATH.fullmatch(href):
+            url = urljoin("https://icook.tw", href)
+            if url in seen or url in pending: continue
+            pending[url] = None
+            if len(pending) >= LIMIT_PER_ING - len(links):
+                links.extend(await drop_known(list(pending)))
+                pending = {}
+                if len(links) >= LIMIT_PER_ING: break
+    if pending:
+        links.extend(await drop_known(list(pending)))
+    links = links[:LIMIT_PER_ING]
+    log(f"👉 {keyword} 找到 {len(links)} 筆新食譜")
+
+    tasks = [scrape_recipe(url, client, pool, f"[{keyword} {i}/{len(links)}]")
+             for i, url in enumerate(links, 1)]
+    results = await asyncio.gather(*tasks)
+    saved = [d for d in results if d]
+
+    # 累積寫歷史（JSONL append，不必讀回整個檔案）
+    append_history(saved)
+
+    # 每個 keyword 抓完整批寫入 Firestore
+    if db and saved:
+        try:
+            # Firestore SDK 為同步呼叫，丟到 thread 避免卡住 event loop
+            n = await asyncio.to_thread(upsert_firestore, saved)
+            log(f"📝 已批次寫入 Firestore：{keyword} {n} 筆")
+        except Exception as e:
+            log(f"⚠️ 寫入 Firestore 失敗（{keyword}）：{e}")
     return saved
 
 # ---------- 主程式 ----------
-def main():
+async def main():
     # start jitter：避免所有排程完全同時發起
     start_jitter = random.uniform(5, 45)  # seconds
     log(f"⏱ 起始隨機延遲 {start_jitter:.1f} 秒以降低被偵測風險")
-    time.sleep(start_jitter)
+    await asyncio.sleep(start_jitter)
 
     log("🚀 爬蟲開始執行")
+    migrate_legacy_history()
+    seen = await asyncio.to_thread(load_seen_links)
+    log(f"📚 本地歷史已有 {len(seen)} 筆食譜，本次略過")
     all_saved: List[dict] = []
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        ctx = browser.new_context(
-            user_agent=("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/124.0.0.0 Safari/537.36"),
-            locale="zh-TW",
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        ctx = await browser.new_context(user_agent=USER_AGENT, locale="zh-TW")
+        # context 層級註冊一次，所有頁面共用
+        await ctx.route("**/*", block_heavy_resources)
+        # 常駐頁面池（搜尋頁 + 食譜頁共用），池大小即同時導頁上限
+        pool = PagePool(ctx, POOL_SIZE, PAGE_MAX_CHECKOUTS)
+        await pool.start()
+        # 食譜頁優先走 HTTP：整個執行期間共用一個 client，keep-alive 連線池重用 TCP/TLS
+        client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                                max_connections=HTTP_MAX_CONNECTIONS),
+            headers={"User-Agent": USER_AGENT, "Accept-Language": "zh-TW,zh;q=0.9"},
+            follow_redirects=True,
+            timeout=30.0,
         )
-        page = ctx.new_page()
-
-        # 可進一步把 COMMON_INGREDIENTS 隨機打散，減少固定行為特徵
-        kws = COMMON_INGREDIENTS.copy()
-        random.shuffle(kws)
-        for kw in kws:
-            docs = scrape_keyword(kw, page)
-            all_saved.extend(docs)
-            # 每抓完一個 keyword，加個較長的隨機等待，降低頻率特徵
-            sec = random.uniform(2.0, 6.0)
-            log(f"  ✋ keyword 間隙等待 {sec:.1f} 秒")
-            time.sleep(sec)
-
-        ctx.close()
-        browser.close()
+
+        try:
+            # 可進一步把關鍵字隨機打散，減少固定行為特徵
+            targets = SEARCH_TARGETS.copy()
+            random.shuffle(targets)
+            # 單一 keyword 的意外錯誤不拖垮整次執行：其餘照常完成並輸出
+            results = await asyncio.gather(*(scrape_keyword(kw, url, client, pool, seen)
+                                             for kw, url in targets), return_exceptions=True)
+            for (kw, _), docs in zip(targets, results):
+                if isinstance(docs, BaseException):
+                    log(f"⚠️ 關鍵字 {kw} 執行失敗：{docs!r}")
+                    continue
+                all_saved.extend(docs)
+        finally:
+            await client.aclose()
+            await pool.close()
+            await ctx.close()
+            await browser.close()
 
     # 輸出 sample json（覆蓋）
     try:
-        with open(SAMPLE_FILE, "w", encoding="utf-8") as f:
-            json.dump(all_saved, f, ensure_ascii=False, indent=2)
+        with open(SAMPLE_FILE, "wb") as f:
+            f.write(orjson.dumps(all_saved, option=orjson.OPT_INDENT_2))
     except Exception as e:
         log(f"⚠️ 寫入 {SAMPLE_FILE} 失敗：{e}")
 
-    # 累積寫歷史
-    history = []
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-                history = json.load(f)
-        except Exception:
-            history = []
-    history.extend(all_saved)
-    try:
-        with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        log(f"⚠️ 寫入 {HISTORY_FILE} 失敗：{e}")
-
     log(f"✅ 完成！本次處理 {len(all_saved)} 筆；已輸出 {SAMPLE_FILE} 並累積到 {HISTORY_FILE}")
 
     # Firestore 統計 & 紀錄
     if db:
         try:
-            docs = db.collection("recipes").stream()
-            total = sum(1 for _ in docs)
+            # 伺服器端 count 聚合：一次 RPC 只回傳數字，不下載整個 collection
+            total = db.collection("recipes").count().get()[0][0].value
             log(f"📊 Firestore 目前 recipes 總筆數：{total}")
             # 新增 crawler_logs 紀錄
             log_doc = {
@@ -360,5 +712,5 @@ def main():
     log("🏁 爬蟲結束")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
 